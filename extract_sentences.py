@@ -8,19 +8,27 @@ Website: http://eur-lex.europa.eu/
 """
 
 import fitz
-from bs4 import BeautifulSoup
-import pandas as pd
+from selectolax.parser import HTMLParser
+import numpy as np
 import nltk
 nltk.download('punkt')
 from nltk.tokenize import sent_tokenize
-import string 
-from thefuzz import fuzz
-from thefuzz import process
+# sent_tokenize loads the Punkt model lazily on first use; tokenize a dummy
+# text at import time so the cost is paid once, before the worker processes
+# fork, instead of on the first document in every worker
+sent_tokenize('Warm up the sentence tokenizer. The model is loaded once here.')
+import string
+from rapidfuzz import fuzz
+from rapidfuzz import process
+from rapidfuzz import utils
+import ahocorasick
+import csv
 import os
 import re
 import argparse
 import sys
 from os.path import exists
+from concurrent.futures import ProcessPoolExecutor
 
 argParser = argparse.ArgumentParser(description='EU Legislation Regulatory Text and Sentence Extractor')
 required = argParser.add_argument_group('required arguments')
@@ -49,11 +57,10 @@ def is_valid_input_dir(arg):
     if arg is None:
         return False, "No valid input directory specified. Type 'python extract_sentences.py -h' for usage help."
     else:
-        count = 0
         if os.path.isdir(str(arg)):
-            for path in os.listdir(str(arg)):
-                if os.path.isfile(os.path.join(str(arg), path)) and str(os.path.basename(os.path.join(str(arg), path))).lower()[-4:] in ['html', 'pdf']:
-                    count += 1
+            with os.scandir(str(arg)) as entries:
+                count = sum(1 for entry in entries
+                            if entry.is_file() and entry.name.lower().endswith(('.html', '.pdf')))
             if count > 0:
                 return True, ''
             else:
@@ -118,6 +125,35 @@ START_TOKENS = ['Article', 'Chapter', 'Section', 'ARTICLE', 'CHAPTER', 'SECTION'
 END_PHRASES = ["Done at", "DONE AT"]
 DEONTICS = ['shall ', 'must ', 'shall not ', 'must not ']
 DIGITS = '0123456789'
+INVALID_FIRST_CHARS = frozenset(string.punctuation + DIGITS)
+STOPWORDS = frozenset(['the', 'and', 'this', 'that', 'for', 'with', 'are', 'its', 'which', 'have', 'has', 'these', 'those', 'from', 'was', 'were', 'had', 'into', 'then'])
+
+# Normalised forms of the excluded phrases, computed once at import time so
+# the hot loops never reprocess these invariant strings per comparison
+_EXCLUDED_PHRASES_LOWER = [phrase.lower() for phrase in EXCLUDED_PHRASES]
+_EXCLUDED_PHRASES_NORM = [utils.default_process(phrase) for phrase in EXCLUDED_PHRASES]
+# str.startswith / str.endswith test all alternatives in C when given a tuple
+_EXCLUDED_START_TUPLE = tuple(EXCLUDED_START_PHRASES)
+_DOC_EXTENSIONS = ('.pdf', '.html')
+
+# Aho-Corasick automaton over the excluded phrases: finds any phrase in a
+# sentence in one linear pass instead of one substring scan per phrase
+_EXCLUDED_AUTOMATON = ahocorasick.Automaton()
+for phrase in _EXCLUDED_PHRASES_LOWER:
+    _EXCLUDED_AUTOMATON.add_word(phrase, phrase)
+_EXCLUDED_AUTOMATON.make_automaton()
+
+# Precompiled regular expressions (compiling inside the per-sentence and
+# per-document loops is expensive, so all patterns are built once here)
+_ARTICLE_RE = re.compile(r"\bArticle \s*\d\d?\d?[a-z]?\s*[A-Z]")
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_DEONTIC_RE = re.compile(r'\b((?:shall|must)(?: not)?)\s')
+# Single alternation over all begin/end phrase pairs: one scan of the
+# document text instead of one scan per (begin, end) combination
+_SECTION_RE = re.compile(
+    f"(?:{'|'.join(BEGIN_PHRASES)})(.*?)(?:{'|'.join(END_PHRASES)})",
+    re.DOTALL | re.IGNORECASE
+)
 
 notexts1_html = []
 notexts2_html = []
@@ -167,33 +203,38 @@ def is_valid_sentence(sent_text):
     global EXCLUDED_PHRASES
     global EXCLUDED_START_PHRASES
 
-    is_valid = True
-    
-    # Rule 1: sentence should not start with any punctuation character (or numerical digit)
-    if len(sent_text) > 0:
-        if sent_text[0] in (string.punctuation + DIGITS):
-            is_valid = False
-        
-    # Rule 2: check if 'EN Official Journal' or 'PAGE' occurs at start of sentence (this indicates an invalid sentence)
-    if sent_text.lower().strip().startswith('en official journal') or sent_text.strip().startswith('PAGE'):
-        is_valid = False
-        
-    # Rule 3: sentence must be at least 15 non-space characters long (otherwise highly unlikely to be a sentence)
+    # The rules are ordered cheapest first and each one returns as soon as
+    # it fails, so invalid sentences never reach the expensive phrase scan
+
+    # Rule 1: sentence must be at least 15 non-space characters long (otherwise highly unlikely to be a sentence)
     if len(sent_text.replace(' ','')) < 15:
-        is_valid = False
-
-    # Rule 4: sentence must not include these phrases (these phrases indicate non-regulatory sentences)
-    for phrase in EXCLUDED_PHRASES:
-        cs = clean_sentence_pass2(sent_text).lower()
-        if (phrase in sent_text.lower()) or (phrase in cs) or (len(cs.split()) < 3):
-            is_valid = False
-
-    # Rule 5: sentence must not include these phrases AT THE START of the sentence        
-    for start_phrase in EXCLUDED_START_PHRASES:
-        if sent_text.lower().startswith(start_phrase):
-            is_valid = False
-        
-    return is_valid
+        return False
+
+    # Lowercased sentence, computed once and reused by the rules below
+    lower = sent_text.lower()
+
+    # Rule 2: check if 'EN Official Journal' or 'PAGE' occurs at start of sentence (this indicates an invalid sentence)
+    if lower.strip().startswith('en official journal') or sent_text.strip().startswith('PAGE'):
+        return False
+
+    # Rule 3: sentence should not start with any punctuation character (or numerical digit)
+    if sent_text[0] in INVALID_FIRST_CHARS:
+        return False
+
+    # Rule 4: sentence must not include these phrases AT THE START of the sentence
+    if lower.startswith(_EXCLUDED_START_TUPLE):
+        return False
+
+    # Rule 5: sentence must not include these phrases (these phrases indicate non-regulatory sentences)
+    pass2_lower = clean_sentence_pass2(sent_text).lower()
+    if len(pass2_lower.split()) < 3:
+        return False
+    if any(True for _ in _EXCLUDED_AUTOMATON.iter(lower)):
+        return False
+    if any(True for _ in _EXCLUDED_AUTOMATON.iter(pass2_lower)):
+        return False
+
+    return True
             
 def clean_sentence_pass2(sent):
     """Formats a sentence to be more easily processed downstream for classifying them as regulatory or not.
@@ -255,15 +296,8 @@ def clean_sentence_pass1(sent_text):
             sent_text = sent_text[1:].strip()
             
     # Rule 2: remove regex 'Article [some number] C' where 'C' is a capital letter
-    done = False
-    while not done:
-        pattern = re.compile(r"\bArticle \s*\d\d?\d?[a-z]?\s*[A-Z]")
-        matches = re.findall(pattern, sent_text)
-        if len(matches) == 0:
-            done = True
-        else:
-            idx_lst_char = len(matches[0]) - 1
-            sent_text = sent_text.replace(matches[0], matches[0][idx_lst_char])
+    # (a single substitution pass replaces each match with its trailing capital)
+    sent_text = _ARTICLE_RE.sub(lambda m: m.group(0)[-1], sent_text)
 
     return sent_text.strip()
     
@@ -277,18 +311,18 @@ def extract_summary(text):
         
         Returns
         -------
-            Formatted text.
+            List of cleaned and validated sentences.
 
     """
     sent_list = sent_tokenize(text)
-    
+
     new_sent_list = []
     for sent in sent_list:
         tmp_sent = clean_sentence_pass1(sent)
         if is_valid_sentence(tmp_sent):
             new_sent_list.append(clean_sentence_pass2(tmp_sent))
 
-    return '\n\n\n'.join(new_sent_list)
+    return new_sent_list
 
 def extract_text_from_pdf(filename, begin_phrases=BEGIN_PHRASES, end_phrases=END_PHRASES):
     global notexts1_pdf, notexts2_pdf
@@ -309,34 +343,41 @@ def extract_text_from_pdf(filename, begin_phrases=BEGIN_PHRASES, end_phrases=END
         
         Returns
         -------
-            Extracted and formatted text from the input PDF file
+            List of extracted and formatted sentences from the input PDF file
 
     """
     
     if filename.endswith('.pdf'):
-        text = ""
-        title = filename.split(".")[0].split("/")[-1]
+        title = os.path.splitext(os.path.basename(filename))[0]
 
+        # collect page texts in a list and join once: repeated string
+        # concatenation reallocates the growing document text on every page
+        page_texts = []
         with fitz.open(filename) as doc:
             for page in doc:
-                current_page_text = page.get_text(sort=True)
-                text += current_page_text
-
-        for bphrase in begin_phrases:
-            for ephrase in end_phrases: 
-                pattern = re.compile(f"(?<={bphrase})(.*?)(?={ephrase})", re.DOTALL | re.IGNORECASE)
-                matches = re.findall(pattern, text)
-                if len(matches) > 0:
-                    the_match = matches[0]
-                    the_match = the_match.replace("\n", " ")
-                    the_match = the_match.replace("­ ", "")
-                    simpler_text = extract_summary(the_match)
-                    if len(simpler_text) < 15:
-                        notexts1_pdf.append(title)
-                    return simpler_text
-            
+                # build the TextPage once and hand it to get_text, so MuPDF
+                # does not repeat its layout analysis inside the call
+                textpage = page.get_textpage(flags=fitz.TEXT_PRESERVE_WHITESPACE)
+                page_texts.append(page.get_text("text", textpage=textpage, sort=True))
+                # once a page contains an end phrase and the combined text
+                # holds a complete section, later pages are never needed
+                if any(ephrase in page_texts[-1] for ephrase in end_phrases):
+                    if _SECTION_RE.search(''.join(page_texts)):
+                        break
+        text = ''.join(page_texts)
+
+        match = _SECTION_RE.search(text)
+        if match:
+            the_match = match.group(1)
+            the_match = the_match.replace("\n", " ")
+            the_match = the_match.replace("­ ", "")
+            sents = extract_summary(the_match)
+            if sum(len(sent) for sent in sents) < 15:
+                notexts1_pdf.append(title)
+            return sents
+
     notexts2_pdf.append(title)
-    return ''
+    return []
 
 def extract_text_from_html(filename, begin_phrases=BEGIN_PHRASES, end_phrases=END_PHRASES):
     global notexts1_html, notexts2_html
@@ -357,35 +398,31 @@ def extract_text_from_html(filename, begin_phrases=BEGIN_PHRASES, end_phrases=EN
         
         Returns
         -------
-            Extracted and formatted text from the input HTML file
+            List of extracted and formatted sentences from the input HTML file
 
     """
     
     if filename.endswith('.html'):
-        title = filename.split(".")[0].split("/")[-1]
-
-        # Opening the html file
-        html_file = open(filename, "r")
-        # Reading the file
-        index = html_file.read()
-        # Creating a BeautifulSoup object and specifying the parser
-        s = BeautifulSoup(index, 'lxml-xml')
-
-        for bphrase in begin_phrases:
-            for ephrase in end_phrases: 
-                pattern = re.compile(f"(?<={bphrase})(.*?)(?={ephrase})", re.DOTALL | re.IGNORECASE)
-                matches = re.findall(pattern, s.text)
-                if len(matches) > 0:
-                    the_match = matches[0]
-                    the_match = the_match.replace("\n", " ")
-                    the_match = the_match.replace("­ ", "")
-                    simpler_text = extract_summary(the_match)
-                    if len(simpler_text) < 15:
-                        notexts1_html.append(title)
-                    return simpler_text
-                
+        title = os.path.splitext(os.path.basename(filename))[0]
+
+        # Read the raw bytes and extract the document text with selectolax,
+        # which walks the DOM in C rather than in Python
+        with open(filename, "rb") as html_file:
+            index = html_file.read()
+        text = HTMLParser(index).text(separator=' ')
+
+        match = _SECTION_RE.search(text)
+        if match:
+            the_match = match.group(1)
+            the_match = the_match.replace("\n", " ")
+            the_match = the_match.replace("­ ", "")
+            sents = extract_summary(the_match)
+            if sum(len(sent) for sent in sents) < 15:
+                notexts1_html.append(title)
+            return sents
+
     notexts2_html.append(title)
-    return ''
+    return []
 
 def remove_stop_words(text):
     """ Removes unwanted tokens from text
@@ -407,42 +444,34 @@ def remove_stop_words(text):
 
     """
 
-    stopwords = ['the', 'and', 'this', 'that', 'for', 'with', 'are', 'its', 'which', 'have', 'has', 'these', 'those', 'from', 'was', 'were', 'had', 'into', 'then']
-    tokens = text.split()
-    for i in range(0, len(tokens)):
-        tokens[i] = re.sub(r'[^\w\s]', '', tokens[i]) # remove punctuation
-        tokens[i] = tokens[i].replace(' ', '') # remove whitespace
-        
-    # remove stop words and words that are less than 3 characters long
-    relevant_tokens = []
-    for token in tokens:
-        if (token.lower() not in stopwords) and (len(token) > 2):
-            relevant_tokens.append(token)
-    
-    return ' '.join(relevant_tokens)
+    # strip punctuation from the whole text in one regex pass, then drop
+    # stop words and words that are less than 3 characters long
+    cleaned = _PUNCT_RE.sub('', text)
+    return ' '.join(token for token in cleaned.split()
+                    if (len(token) > 2) and (token.lower() not in STOPWORDS))
             
-def get_doc_lengths(text):
+def get_doc_lengths(sents):
     """ Calculates two metrics of document length: word count and sentence count
 
         Parameters
         ----------
-        
-        text: str
-            Input text string.
-        
+
+        sents: list
+            List of sentences in the document.
+
         Returns
         -------
             word count: int,
-                Number of substantive words in the given text
+                Number of substantive words in the given sentences
 
             sent_count: int,
-                Number of sentences in the given text
+                Number of sentences in the given list
 
     """
-    
-    sent_count = len(text.split('\n\n\n'))
-    word_count = len(remove_stop_words(text).split())
-    
+
+    sent_count = len(sents)
+    word_count = len(remove_stop_words(' '.join(sents)).split())
+
     return word_count, sent_count
 
 def get_deontic_type(sent, deontics=DEONTICS):
@@ -461,16 +490,16 @@ def get_deontic_type(sent, deontics=DEONTICS):
             Pipe-delimited string of deontic phrases in the sentence
 
     """
-    result = []
-    for deontic in deontics:
-        if deontic in " ".join(sent.split()):
-            result.append(deontic)
+    # one linear regex scan finds all deontic phrases at once; 'shall not'
+    # matches as a whole rather than double-counting as 'shall'
+    hits = {match + ' ' for match in _DEONTIC_RE.findall(sent)}
+    result = [deontic for deontic in deontics if deontic in hits]
     if len(result) == 0:
         return 'None'
     else:
         return ' | '.join(result)
     
-def identify_info(filename, text, deontics=DEONTICS):
+def identify_info(filename, sents, deontics=DEONTICS):
     global culprits
     global trouble_sents
     """ Extracts metadata and sentences from a document
@@ -480,9 +509,9 @@ def identify_info(filename, text, deontics=DEONTICS):
         
         filename: str
             Filename (not path) of document
-        text: str
-            Text in the document to extract metadata and sentences from
-        
+        sents: list
+            Sentences in the document to extract metadata from
+
         Returns
         -------
             List of lists where each list is a row in a dataframe or table:
@@ -495,54 +524,72 @@ def identify_info(filename, text, deontics=DEONTICS):
             doc_format: PDF or HTML?
 
     """
-    word_count, sentence_count = get_doc_lengths(text)
+    word_count, sentence_count = get_doc_lengths(sents)
     rows = []
-    sents = text.split('\n\n\n')
+    sents = [sent.strip() for sent in sents]
     doc_format = 'pdf' if filename.endswith('.pdf') else 'html'
-    d = '.'+doc_format
-    # Filter out sentences that include negative flags for regulatory text
-    for sent in sents:
-        exclude = False
-        for item in EXCLUDED_PHRASES:
-            if fuzz.ratio(sent.strip(), item) >= 90:
-                trouble_sents.append([filename.replace(d,''), sent])
-                exclude = True
-        
-        if not exclude:
-            current_row = []
-            current_row.append(filename.replace('.pdf','').replace('.html','')) # celex number (identifier) of document
-            current_row.append(sent.strip()) # sentence text
-            deontic_types = get_deontic_type(sent.strip())
-            current_row.append(deontic_types) # deontic types in the sentence
-            current_row.append(word_count) # word count in document
-            current_row.append(sentence_count) # sentence count in document
-            current_row.append(doc_format) # PDF or HTML?
-            if deontic_types != 'None':
-                rows.append(current_row)
+    celex = os.path.splitext(filename)[0] # celex number (identifier) of document
+    # Filter out sentences that include negative flags for regulatory text.
+    # cdist scores all sentence / phrase pairs in one batched native call.
+    scores = process.cdist([utils.default_process(sent) for sent in sents],
+                           _EXCLUDED_PHRASES_NORM, scorer=fuzz.ratio,
+                           processor=None, score_cutoff=90, dtype=np.uint8,
+                           workers=-1)
+    exclude_mask = scores.max(axis=1) >= 90
+    for sent, exclude in zip(sents, exclude_mask):
+        if exclude:
+            trouble_sents.append([celex, sent])
+            continue
+
+        deontic_types = get_deontic_type(sent)
+        if deontic_types != 'None':
+            # row layout: celex, sentence, deontics, word count, sentence count, format
+            rows.append((celex, sent, deontic_types, word_count, sentence_count, doc_format))
 
     if len(rows) == 0:
-        d = '.'+doc_format
-        culprits.append(filename.replace(d, ''))
-        
+        culprits.append(celex)
+
     return rows
 
+def process_document(path):
+    """ Extracts the sentence rows for a single document (PDF or HTML)
+
+        Parameters
+        ----------
+
+        path: str
+            Path to the document to process
+
+        Returns
+        -------
+            List of rows as produced by identify_info() for this document
+
+    """
+    filename = os.path.basename(path)
+    if filename.lower().endswith('.pdf'): # PDFs
+        new_doc = extract_text_from_pdf(path)
+    else: # HTMLs
+        new_doc = extract_text_from_html(path)
+    return identify_info(filename, new_doc)
+
 # END: function definitions
 # BEGIN: process input and generate prepared data for:
 # 1. Ground truth labelling by legal experts (regulatory (1) or constitutive (0) and attribute label)
 #    -> Also used as training data for few shot text classifier
 # 2. Evaluation of rule-based NLP dependency parser analysis algorithm (regulatory (1) or constitutive (0) and attribute label)
 
-rows = []
-# Process documents
+# Process documents in parallel: each file is independent, so the work is
+# spread across one worker process per core
 with os.scandir(INPUT_DIR) as iter:
-    for i, filename in enumerate(iter):
-        if filename.name.lower().endswith('.pdf') or filename.name.lower().endswith('.html'):
-            if filename.name.lower().endswith('.pdf'): # PDFs
-                new_doc = extract_text_from_pdf(os.path.join(INPUT_DIR, filename.name))
-            elif filename.name.lower().endswith('.html'): # HTMLs
-                new_doc = extract_text_from_html(os.path.join(INPUT_DIR, filename.name))
-            rows.extend(identify_info(filename.name, new_doc))
-
-# Write dataframe to file
-df = pd.DataFrame(rows, columns=['celex', 'sent', 'deontic', 'word_count', 'sent_count', 'doc_format'])
-df.to_csv(OUTPUT_FILE, index=False)
+    paths = [os.path.join(INPUT_DIR, filename.name) for filename in iter
+             if filename.name.lower().endswith(_DOC_EXTENSIONS)]
+
+if __name__ == '__main__':
+    # Stream rows to the CSV file as each document finishes, so memory
+    # stays bounded regardless of how many documents are processed
+    with open(OUTPUT_FILE, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['celex', 'sent', 'deontic', 'word_count', 'sent_count', 'doc_format'])
+        with ProcessPoolExecutor() as executor:
+            for doc_rows in executor.map(process_document, paths, chunksize=8):
+                writer.writerows(doc_rows)
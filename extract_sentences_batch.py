@@ -18,8 +18,8 @@ import nltk
 nltk.download('punkt')
 from nltk.tokenize import sent_tokenize
 import string 
-from thefuzz import fuzz
-from thefuzz import process
+from rapidfuzz import fuzz
+from rapidfuzz import process
 import os
 import re
 import time
@@ -52,11 +52,10 @@ def is_valid_input_dir(arg):
     if arg is None:
         return False, "No valid input directory specified. Type 'python extract_sentences_batch.py -h' for usage help."
     else:
-        count = 0
         if os.path.isdir(str(arg)):
-            for path in os.listdir(str(arg)):
-                if os.path.isfile(os.path.join(str(arg), path)) and str(os.path.basename(os.path.join(str(arg), path))).lower()[-4] in ['html', 'pdf']:
-                    count += 1
+            with os.scandir(str(arg)) as entries:
+                count = sum(1 for entry in entries
+                            if entry.is_file() and entry.name.lower().endswith(('.html', '.pdf')))
             if count > 0:
                 return True, ''
             else: